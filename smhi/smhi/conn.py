@@ -6,13 +6,23 @@ import logging
 logging.basicConfig()
 logging.getLogger("sqlalchemy.engine.Engine.smhi").setLevel(logging.INFO)
 
-def get_engine():
-    """Create and return the database engine."""
+def get_engine(poolclass=None):
+    """
+    Create and return the database engine.
+    Pass poolclass=NullPool for processes that hold a single connection and need no pooling.
+    """
     config = {
         "host": os.getenv("DB_HOST"),
         "database": os.getenv("DB_NAME"),
         "user": os.getenv("DB_USER"),
         "password": os.getenv("DB_PASSWORD")
     }
-    engine = create_engine(f'postgresql+psycopg2://{config["user"]}:{config["password"]}@{config["host"]}/{config["database"]}')
+    engine = create_engine(
+        f'postgresql+psycopg2://{config["user"]}:{config["password"]}@{config["host"]}/{config["database"]}',
+        # Batch executemany() calls into multi-row statements instead of one statement per row
+        executemany_mode="values_plus_batch",
+        insertmanyvalues_page_size=1000,
+        executemany_batch_page_size=500,
+        poolclass=poolclass
+    )
     return engine
@@ -3,12 +3,14 @@ from dotenv import load_dotenv
 from smhi.conn import get_engine
 from smhi.seed.station import seed_weather_stations
 from smhi.seed.station_data import seed_weather_data
+from smhi.seed.station_grid import seed_nearest_station_grid
 
-from smhi.models import Base, WeatherData, WeatherStation
+from smhi.models import Base, NearestStationGrid, WeatherData, WeatherStation
 
 load_dotenv(override=True)
 
 def init_db(engine):
+    NearestStationGrid.__table__.drop(engine, checkfirst=True)
     WeatherData.__table__.drop(engine)
     WeatherStation.__table__.drop(engine)
     Base.metadata.create_all(bind=engine)
@@ -16,6 +18,8 @@ def init_db(engine):
 def seed_database(engine):
     seed_weather_stations(engine)
     seed_weather_data(engine)
+    # The grid only considers stations with data, so it is seeded last
+    seed_nearest_station_grid(engine)
 
 if __name__ == "__main__":
     engine = get_engine()
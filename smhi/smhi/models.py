@@ -1,12 +1,32 @@
 from datetime import datetime
 from typing import List
-from sqlalchemy import String, DateTime, Float, ForeignKey, Integer, Boolean
+from sqlalchemy import String, DateTime, Float, ForeignKey, Integer, Boolean, Index, DDL, event
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Mapped, relationship, mapped_column
 from geoalchemy2 import Geometry, WKBElement
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
 
+# SQL helper for building SWEREF99 TM points. As an IMMUTABLE, PARALLEL SAFE SQL function it can be
+# inlined and constant-folded by the planner, and used in parallel plans and expression indexes.
+MK_POINT_3006 = DDL("""
+    CREATE OR REPLACE FUNCTION mk_point_3006(x double precision, y double precision)
+    RETURNS geometry
+    LANGUAGE sql IMMUTABLE PARALLEL SAFE
+    AS $$ SELECT ST_SetSRID(ST_MakePoint(x, y), 3006) $$
+""")
+event.listen(Base.metadata, "before_create", MK_POINT_3006)
+
+# Size in meters of the cells in NearestStationGrid, and the number of stations stored per cell.
+# Stations are tens of kilometers apart, so the nearest stations to a 5 km cell's centre are
+# nearly always those of any point in it. A multiple of the snapping size in weather.py.
+GRID_CELL_SIZE = 5000
+GRID_NEAREST_K = 3
+# Radius in meters around a cell's centre in which stations are stored, the default search radius
+# of the nearest-value lookups. Cells without stations within it are left out of the grid.
+GRID_SEARCH_RADIUS = 150_000
+
 class WeatherStation(Base):
     __tablename__ = 'weather_station'
     id: Mapped[int] = mapped_column(primary_key=True)
@@ -28,6 +48,9 @@ class WeatherStation(Base):
     height: Mapped[Float] = mapped_column(Float)
 
     geom: Mapped[WKBElement] = mapped_column(Geometry("Point", srid=3006, spatial_index=True), nullable=True)
+    # Coordinates of geom (SWEREF99 TM), stored so reads don't need ST_X/ST_Y per row
+    x: Mapped[float] = mapped_column(Float, nullable=True)
+    y: Mapped[float] = mapped_column(Float, nullable=True)
 
     data_url: Mapped[str] = mapped_column(String)
     data: Mapped[List["WeatherData"]] = relationship(back_populates="weather_station")
@@ -35,11 +58,26 @@ class WeatherStation(Base):
 
 class WeatherData(Base):
     __tablename__ = 'weather_data'
+    # Lookups filter on parameter and a date or date range, serve both from a single index.
+    # It also serves parameter-only filters, so parameter has no index of its own.
+    __table_args__ = (Index("ix_weather_data_parameter_date", "parameter", "date"),)
     id: Mapped[int] = mapped_column(primary_key=True)
     weather_station: Mapped["WeatherStation"] = relationship(back_populates="data")
     weather_station_id: Mapped[int] = mapped_column(ForeignKey("weather_station.id"), index=True)
     date: Mapped[datetime] = mapped_column(DateTime())
     date_local: Mapped[datetime] = mapped_column(DateTime(), index=True)
-    parameter: Mapped[str] = mapped_column(String(30), index=True) # air_temperature, wind, precipitation
+    parameter: Mapped[str] = mapped_column(String(30)) # air_temperature, wind, precipitation
     value: Mapped[float] = mapped_column(Float) # air_temperature, wind, precipitation
     quality: Mapped[str] = mapped_column(String(3))
+
+
+class NearestStationGrid(Base):
+    """
+    Precomputed nearest weather stations for a grid of GRID_CELL_SIZE cells, per parameter.
+    A cell is addressed by floor(x / GRID_CELL_SIZE), floor(y / GRID_CELL_SIZE).
+    """
+    __tablename__ = 'nearest_station_grid'
+    cell_x: Mapped[int] = mapped_column(Integer, primary_key=True)
+    cell_y: Mapped[int] = mapped_column(Integer, primary_key=True)
+    parameter: Mapped[str] = mapped_column(String(30), primary_key=True)
+    station_ids: Mapped[List[int]] = mapped_column(ARRAY(Integer))  # Ordered nearest first
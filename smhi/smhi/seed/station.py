@@ -1,10 +1,12 @@
 # Standard library imports
 import json
 import os
+from datetime import datetime
 from typing import List, Dict
 
 # Third-party imports
 from alive_progress import alive_bar
+import numpy as np
 import sqlalchemy.orm as orm
 from requests import Session
 from requests_cache import CacheMixin
@@ -12,7 +14,7 @@ from requests_ratelimiter import LimiterMixin
 from pyproj import Transformer
 
 # Local imports
-from smhi.util.time import get_millisecond_datetime
+from smhi.util.time import get_millisecond_datetimes
 from smhi.models import WeatherStation
 
 
@@ -44,35 +46,30 @@ PARAMETER_MAPPING = {
 # Transformer for coordinates
 TRANSFORMER = Transformer.from_crs("EPSG:4326", "EPSG:3006", always_xy=True)
 
-def get_station_data_url(station: Dict) -> str:
-    """Extract and return the data URL for the station's corrected-archive."""
-    station_url = None
-    for link in station["link"]:
-        if link['type'] == 'application/json':
-            station_url = link["href"]
-            break
-
-    response = SESSION.get(station_url)
-    station_periods = response.json()['period']
-
-    period_url = None
-    for period in station_periods:
-        if period["key"] == "corrected-archive":
-            for link in period["link"]:
-                if link["type"] == 'application/json':
-                    period_url = link["href"]
-                    break
-
-    if not period_url:
-        raise ValueError(f"No link to corrected-archive for station {station['key']}")
-    
-    return SESSION.get(period_url).json()['data'][0]["link"][0]["href"]
+def get_station_data_url(station: Dict, parameter: str) -> str:
+    """
+    Return the data URL for the station's corrected-archive.
+    The URL follows a fixed pattern, so it is built directly rather than looked up through the
+    station and period endpoints. Stations without a corrected-archive get a URL that returns 404,
+    which the data seeding treats as a station without data.
+    """
+    return (
+        f"{ENTRY_POINT}/parameter/{PARAMETER_MAPPING[parameter]}"
+        f"/station/{station['key']}/period/corrected-archive/data.csv"
+    )
 
 
-def build_weather_station_data(station: Dict, parameter: str) -> WeatherStation:
-    """Build and return a WeatherStation object from raw API data."""
-    x, y = TRANSFORMER.transform(station['longitude'], station['latitude'])
-    
+def build_weather_station_data(
+        station: Dict,
+        parameter: str,
+        data_url: str,
+        x: float,
+        y: float,
+        updated: datetime,
+        time_from: datetime,
+        time_to: datetime
+    ) -> WeatherStation:
+    """Build and return a WeatherStation object from raw API data and its resolved fields."""
     return WeatherStation(
         key=station["key"],
         title=station["title"],
@@ -81,18 +78,19 @@ def build_weather_station_data(station: Dict, parameter: str) -> WeatherStation:
         measuring_stations=station["measuringStations"],
         parameter=parameter,
         active=bool(station["active"]),
-        updated=get_millisecond_datetime(station["updated"]),
-        time_from=get_millisecond_datetime(station["from"]),
-        time_to=get_millisecond_datetime(station["to"]),
+        updated=updated,
+        time_from=time_from,
+        time_to=time_to,
         geom=f"SRID=3006;POINT({x} {y})",
+        x=float(x),
+        y=float(y),
         height=station['height'],
-        data_url=get_station_data_url(station)
+        data_url=data_url
     )
 
 
 def fetch_weather_stations() -> List[WeatherStation]:
     """Fetch and process weather stations for a given parameter."""
-    stations = []
     stations_per_parameter = {}
     n_stations = 0
 
@@ -101,18 +99,28 @@ def fetch_weather_stations() -> List[WeatherStation]:
         print(parameter, PARAMETER_MAPPING[parameter])
         stations_per_parameter[parameter] = response
         n_stations += len(response["station"])
-        
+
+    resolved = []
     with alive_bar(n_stations, title=f"Seeding Weather Stations", bar="filling") as bar:
         for parameter in stations_per_parameter.keys():
             bar.text(parameter)
             for station in stations_per_parameter[parameter]["station"]:
-                try:
-                    stations.append(build_weather_station_data(station, parameter))
-                except ValueError as e:
-                    print(f"Error processing station {station['key']}: {e}")
+                resolved.append((station, parameter, get_station_data_url(station, parameter)))
                 bar()
 
-    return stations
+    # Project the coordinates and convert the timestamps of all stations at once
+    xs, ys = TRANSFORMER.transform(
+        np.array([station["longitude"] for station, _, _ in resolved], dtype=np.float64),
+        np.array([station["latitude"] for station, _, _ in resolved], dtype=np.float64)
+    )
+    updated = get_millisecond_datetimes([station["updated"] for station, _, _ in resolved])
+    time_from = get_millisecond_datetimes([station["from"] for station, _, _ in resolved])
+    time_to = get_millisecond_datetimes([station["to"] for station, _, _ in resolved])
+
+    return [
+        build_weather_station_data(station, parameter, data_url, *fields)
+        for (station, parameter, data_url), *fields in zip(resolved, xs, ys, updated, time_from, time_to)
+    ]
 
 
 def seed_weather_stations(engine) -> None:
@@ -1,18 +1,27 @@
 # System imports
-from io import StringIO
+import os
+from io import BytesIO, StringIO
+from typing import NamedTuple
 
 # Third-party imports
-import pandas as pd
 import numpy as np
+import pandas as pd
+from psycopg2.extras import execute_values
 from requests import Session
 from requests_cache import CacheMixin
 from requests_ratelimiter import LimiterMixin
-from sqlalchemy import insert, select
+from sqlalchemy import select
 import sqlalchemy.orm as orm
 
 # Local imports
 from smhi.util.multiprocessing import BaseWorker, BaseManager
-from smhi.models import WeatherData, WeatherStation
+from smhi.models import WeatherStation
+
+
+# Column order of the rows streamed into weather_data through COPY
+WEATHER_DATA_COLUMNS = ["weather_station_id", "date", "date_local", "parameter", "value", "quality"]
+# Number of buffered rows after which a worker writes its stations to the database
+FLUSH_ROWS = 50_000
 
 
 class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
@@ -20,81 +29,221 @@ class CachedLimiterSession(CacheMixin, LimiterMixin, Session):
     pass
 
 
+class StationJob(NamedTuple):
+    """Weather station fields a worker needs, passed through the queue instead of looked up."""
+    id: int
+    key: int
+    parameter: str
+    data_url: str
+
+
 class WeatherDataWorker(BaseWorker):
     """
     Worker process that fetches and processes weather data.
-    Each worker has its own engine and session.
+    Each worker has its own engine and keeps a single database connection open.
+    Parsed station data is buffered and written in bulk, one transaction per flush.
+    Stations are only reported as done once their rows are committed.
     """
     def __init__(self, *args):
         self.smhi_cache = None
+        self.connection = None
+        self._buf: dict[StationJob, pd.DataFrame] = {}
+        self._buf_attempts: dict[StationJob, int] = {}
+        self._buf_rows = 0
         super().__init__(*args)
     
     def run(self):
         self.smhi_cache = CachedLimiterSession('cache', per_second=2)
         super().run()
 
-    def process_job(self, station_id: int) -> None:
+    def process_job(self, station: StationJob) -> None:
         """Fetch and process weather data for a station."""
-        with orm.Session(self.engine) as db_session:
-            station = db_session.get(WeatherStation, station_id)
-            if not station:
-                return
-            station_data = self.fetch_weather_station_data(station)
-            if station_data:
-                db_session.execute(insert(WeatherData), station_data)
-                db_session.commit()
-
-    def fetch_weather_station_data(self, weather_station: WeatherStation) -> list[dict[str, any]] | None:
-        """Fetch and process weather data for a specific station."""
+        station_data = self.fetch_weather_station_data(station)
+        if station_data is not None:
+            self._buf[station] = station_data
+
+    def job_done(self, station: StationJob, attempts: int) -> None:
+        """Report stations without data right away, buffered stations are reported by flush."""
+        if station not in self._buf:
+            super().job_done(station, attempts)
+            return
+        self._buf_attempts[station] = attempts
+        self._buf_rows += len(self._buf[station])
+        if self._buf_rows >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Write all buffered station data to the database and report the stations as done.
+        If the bulk write fails, the stations are written one by one so only the failing ones are retried.
+        """
+        if not self._buf:
+            return
+        buf, buf_attempts = self._buf, self._buf_attempts
+        self._buf, self._buf_attempts, self._buf_rows = {}, {}, 0
+
+        try:
+            self.write(pd.concat(buf.values(), ignore_index=True))
+        except Exception as e:
+            print(f"Error writing data for {len(buf)} stations: {e}")
+            for station, station_data in buf.items():
+                try:
+                    self.write(station_data)
+                except Exception as e:
+                    print(f"Error writing data for station {station.key}: {e}")
+                    self.job_failed(station, buf_attempts[station])
+                    continue
+                super().job_done(station, buf_attempts[station])
+            return
+        for station, attempts in buf_attempts.items():
+            super().job_done(station, attempts)
+
+    def write(self, df: pd.DataFrame) -> None:
+        """Write weather data on the worker's connection, reconnecting on the next write if it fails."""
+        if self.connection is None:
+            self.connection = self.engine.raw_connection()
+        try:
+            write_weather_data(self.connection, df)
+        except Exception:
+            self.connection.close()
+            self.connection = None
+            raise
+
+    def idle(self) -> None:
+        """Flush buffered station data while waiting for jobs, so the stations are reported as done."""
+        self.flush()
+
+    def teardown(self) -> None:
+        """Flush remaining station data and close the connection before the worker exits."""
+        try:
+            self.flush()
+        finally:
+            if self.connection is not None:
+                self.connection.close()
+
+    def fetch_weather_station_data(self, weather_station: StationJob) -> pd.DataFrame | None:
+        """
+        Fetch and process weather data for a specific station.
+        Returns a frame with WEATHER_DATA_COLUMNS, with naive UTC date, naive Europe/Stockholm
+        date_local and float64 value, as expected by write_weather_data.
+        """
         response = self.smhi_cache.get(weather_station.data_url)
+        if response.status_code == 404:
+            # Station has no corrected-archive
+            return None
         if response.status_code != 200:
             raise ConnectionError(f"Failed to fetch data for station {weather_station.key}")
 
-        file = StringIO(response.content.decode())
-
-        # Skip header lines
-        for line in file:
-            if line.startswith('Datum'):
-                break
+        # Skip header lines, keeping the 'Datum' line as the CSV header
+        raw = response.content
+        idx = raw.find(b'\nDatum')
+        if idx == -1:
+            return None
 
+        # Only the first four columns are read. Data rows are often shorter than the header, which
+        # ends in note columns that only the first rows fill, so the C engine with usecols is used
+        # rather than a reader that rejects rows narrower than the header.
+        # Values are parsed as float64, so COPY and INSERT both write the value as it appears in the CSV.
         df = pd.read_csv(
-            file, sep=';', header=0, index_col=False,
+            BytesIO(raw[idx + 1:]), sep=';', header=0, index_col=False, engine="c",
             usecols=[0, 1, 2, 3],
             names=["date", "time", "value", "quality"],
-            dtype={'date': str, 'time': str, 'value': np.float32, 'quality': str}
-        )  
-        df = df[df['quality'] == 'G']
-        
+            dtype={"date": str, "time": str, "value": np.float64, "quality": str}
+        )
+        df = df[df["quality"] == "G"]
+
+        # Combine 'date' and 'time' columns into a single datetime column.
+        # Malformed dates or times become NaT and only their rows are dropped.
+        df["date"] = (
+            pd.to_datetime(df["date"], format="%Y-%m-%d", errors="coerce")
+            + pd.to_timedelta(df["time"], errors="coerce")
+        )
+
         # Handle edge cases where data is missing or formatted unusually
-        df = df[(df['date'] != '') & df['date'].notna()]
+        df = df[df["date"].notna() & df["value"].notna()]
         if df.empty:
             # print(f"All rows in weather station - {weather_station.id} are NA.")
             return None
 
-        # Combine 'date' and 'time' columns into a single datetime column
-        df["date"] = pd.to_datetime(df["date"] + " " + df["time"], format="%Y-%m-%d %H:%M:%S")
         # TODO remove
         df = df[df["date"] >= pd.Timestamp("2002-01-01")]
-        df["date"] = df["date"].dt.tz_localize('UTC')
-        df["date_local"] = df["date"].dt.tz_convert('Europe/Stockholm')
+        # Timestamps are stored naive: date is the UTC wall-clock time of the measurement and
+        # date_local the Europe/Stockholm wall-clock time. Passing naive values keeps Postgres from
+        # applying the session TimeZone (INSERT) or dropping the offset (COPY) differently per writer.
+        df["date_local"] = df["date"].dt.tz_localize('UTC').dt.tz_convert('Europe/Stockholm').dt.tz_localize(None)
         
-        # Add additional columns derived from the WeatherStation object
+        # Add additional columns derived from the weather station
         df["weather_station_id"] = weather_station.id
         df["parameter"] = weather_station.parameter
-        df = df[["weather_station_id", "date", "date_local", "parameter", "value", "quality"]]
+        return df[WEATHER_DATA_COLUMNS]
+
+
+def copy_weather_data(conn, df: pd.DataFrame) -> None:
+    """Stream a DataFrame of weather data into the database using COPY."""
+    buf = StringIO()
+    df.to_csv(buf, index=False, header=False, columns=WEATHER_DATA_COLUMNS)
+    buf.seek(0)
+
+    try:
+        with conn.cursor() as cur:
+            cur.copy_expert(
+                f"COPY weather_data ({', '.join(WEATHER_DATA_COLUMNS)}) FROM STDIN WITH (FORMAT CSV)",
+                buf
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
 
-        return df.to_dict(orient="records")
+
+def bulk_insert_weather_data(conn, df: pd.DataFrame) -> None:
+    """
+    Insert a DataFrame of weather data using multi-row INSERT statements.
+    Slower than COPY, but usable where plain INSERT semantics are needed (e.g. ON CONFLICT).
+    """
+    page_size = int(os.getenv("INSERT_PAGE_SIZE", 1000))
+    rows = df[WEATHER_DATA_COLUMNS].itertuples(index=False, name=None)
+
+    try:
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"INSERT INTO weather_data ({', '.join(WEATHER_DATA_COLUMNS)}) VALUES %s",
+                rows,
+                page_size=page_size
+            )
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def write_weather_data(conn, df: pd.DataFrame) -> None:
+    """
+    Write weather data using the method set by INSERT_METHOD ("copy" or "values").
+    Both methods store the same rows for a frame from fetch_weather_station_data: date and date_local
+    are written as the naive wall-clock times they hold (UTC and Europe/Stockholm respectively).
+    """
+    if os.getenv("INSERT_METHOD", "copy") == "values":
+        bulk_insert_weather_data(conn, df)
+    else:
+        copy_weather_data(conn, df)
 
 
 class WeatherDataManager(BaseManager):
     """Manager class to handle queue, progress tracking, and worker processes."""
 
     def create_jobs(self) -> None:
-        """Add station IDs to the queue."""
+        """Add the stations to fetch data for to the queue."""
+        query = select(
+            WeatherStation.id,
+            WeatherStation.key,
+            WeatherStation.parameter,
+            WeatherStation.data_url
+        )
         with orm.Session(self.engine) as session:
-            for id in session.scalars(select(WeatherStation.id)).all():
-                self.job_queue.put(id)
-                self.total_jobs += 1
+            for row in session.execute(query).all():
+                self.add_job(StationJob(*row))
 
 
 def seed_weather_data(engine) -> None:
@@ -0,0 +1,66 @@
+# Third-party imports
+from alive_progress import alive_bar
+from sqlalchemy import select, text
+import sqlalchemy.orm as orm
+
+# Local imports
+from smhi.models import GRID_CELL_SIZE, GRID_NEAREST_K, GRID_SEARCH_RADIUS, WeatherStation
+
+
+# For every cell within the search radius of a parameter's stations, store the ids of the k stations
+# nearest to the cell centre. Only stations with weather data are candidates, so closed historic
+# stations and stations without a corrected-archive don't take the place of stations with data.
+GRID_QUERY = text("""
+    WITH stations AS (
+        SELECT ws.x, ws.y
+        FROM weather_station ws
+        WHERE ws.parameter = :parameter
+        AND EXISTS (SELECT 1 FROM weather_data wd WHERE wd.weather_station_id = ws.id)
+    ),
+    cells AS (
+        SELECT cell_x, cell_y, mk_point_3006((cell_x + 0.5) * :size, (cell_y + 0.5) * :size) AS centre
+        FROM (
+            SELECT
+                floor((min(x) - :radius) / :size)::int AS x0, floor((max(x) + :radius) / :size)::int AS x1,
+                floor((min(y) - :radius) / :size)::int AS y0, floor((max(y) + :radius) / :size)::int AS y1
+            FROM stations
+        ) extent,
+        generate_series(extent.x0, extent.x1) AS cell_x,
+        generate_series(extent.y0, extent.y1) AS cell_y
+    ),
+    nearest AS (
+        SELECT cell_x, cell_y, ARRAY(
+            SELECT ws.id
+            FROM weather_station ws
+            WHERE ws.parameter = :parameter
+            AND ST_DWithin(ws.geom, cells.centre, :radius)
+            AND EXISTS (SELECT 1 FROM weather_data wd WHERE wd.weather_station_id = ws.id)
+            ORDER BY ws.geom <-> cells.centre
+            LIMIT :k
+        ) AS station_ids
+        FROM cells
+    )
+    INSERT INTO nearest_station_grid (cell_x, cell_y, parameter, station_ids)
+    SELECT cell_x, cell_y, :parameter, station_ids
+    FROM nearest
+    WHERE cardinality(station_ids) > 0
+""")
+
+
+def seed_nearest_station_grid(engine) -> None:
+    """
+    Precompute the nearest stations of every grid cell, for each parameter with stations.
+    Candidates are stations with weather data, so this runs after the weather data is seeded.
+    """
+    with orm.Session(engine) as session:
+        parameters = session.scalars(select(WeatherStation.parameter).distinct()).all()
+
+        with alive_bar(len(parameters), title="Seeding Nearest Station Grid", bar="filling") as bar:
+            for parameter in parameters:
+                bar.text(parameter)
+                session.execute(GRID_QUERY, {
+                    "parameter": parameter, "size": GRID_CELL_SIZE,
+                    "k": GRID_NEAREST_K, "radius": GRID_SEARCH_RADIUS
+                })
+                session.commit()
+                bar()
@@ -1,17 +1,24 @@
 import os
 import multiprocessing as mp
+from queue import Empty
 from alive_progress import alive_bar
+from sqlalchemy.pool import NullPool
 from smhi.conn import get_engine
 
 class BaseWorker(mp.Process):
     """
     Base class for worker processes.
     Provides database access and queue-based processing.
+    Every job is reported to the done queue as (job, ok), failing jobs are retried up to
+    max_attempts times before being reported as failed.
     """
-    def __init__(self, job_queue, progress_counter):
+    max_attempts = 3
+    idle_timeout = 1  # Seconds without a job after which idle() is called
+
+    def __init__(self, job_queue, done_queue):
         super().__init__()
         self.job_queue = job_queue
-        self.progress_counter = progress_counter
+        self.done_queue = done_queue
         self.engine = None
 
     def process_job(self, job):
@@ -20,24 +27,61 @@ class BaseWorker(mp.Process):
         """
         raise NotImplementedError("Subclasses must implement this method!")
 
+    def idle(self):
+        """
+        Override this method in subclasses to finish pending work while the queue is empty.
+        """
+        pass
+
+    def teardown(self):
+        """
+        Override this method in subclasses to finish pending work before the worker exits.
+        """
+        pass
+
     def run(self):
         """
         Process jobs from the queue until a sentinel (None) is received.
+        Jobs arrive as (job, attempts) tuples.
         """
-        self.engine = get_engine()  # Get a database engine for this worker
+        # Create the engine inside the process so no connections are shared across fork,
+        # without a pool since each worker holds a single connection
+        self.engine = get_engine(poolclass=NullPool)
         while True:
-            job = self.job_queue.get()
-            if job is None:  # Sentinel value to terminate worker
-                self.job_queue.task_done()
-                self.engine.dispose()
+            try:
+                item = self.job_queue.get(timeout=self.idle_timeout)
+            except Empty:
+                self.idle()
+                continue
+            if item is None:  # Sentinel value to terminate worker
+                try:
+                    self.teardown()
+                finally:
+                    self.engine.dispose()
                 break
+            job, attempts = item
             try:
                 self.process_job(job)
-                with self.progress_counter.get_lock():
-                    self.progress_counter.value += 1  # Increment progress
             except Exception as e:
                 print(f"Error processing job {job}: {e}")
-                self.job_queue.put(job)  # Re-add the job to the queue
+                self.job_failed(job, attempts)
+                continue
+            self.job_done(job, attempts)
+
+    def job_done(self, job, attempts):
+        """
+        Report a finished job to the manager.
+        """
+        self.done_queue.put((job, True))
+
+    def job_failed(self, job, attempts):
+        """
+        Re-add a failed job to the queue, or report it as failed once it has used all its attempts.
+        """
+        if attempts + 1 < self.max_attempts:
+            self.job_queue.put((job, attempts + 1))
+        else:
+            self.done_queue.put((job, False))  # Give up on the job
 
 
 class BaseManager:
@@ -47,12 +91,14 @@ class BaseManager:
     def __init__(self, engine, title, num_workers=-1):
         self.num_workers = os.cpu_count() if num_workers == -1 else num_workers
         self.engine = engine
-        self.manager = mp.Manager()
         self.title = title
         self.num_workers = num_workers
-        self.job_queue = self.manager.Queue()
+        self.job_queue = mp.Queue()  # Plain queue, avoids the round-trip through a Manager process
         self.workers = []
-        self.progress_counter = mp.Value('i', 0)  # Shared progress counter
+        # Workers post (job, ok) per finished job. Failures go through the same queue, which the
+        # manager reads until the end, so no worker blocks on exit with unread items in its queue.
+        self.done_queue = mp.Queue()
+        self.failed_jobs = []  # Jobs that failed on every attempt
         self.total_jobs = 0  # Total number of jobs to track progress
 
     def create_jobs(self):
@@ -61,12 +107,19 @@ class BaseManager:
         """
         raise NotImplementedError("Subclasses must implement this method!")
 
+    def add_job(self, job):
+        """
+        Add a job to the queue, to be used from create_jobs.
+        """
+        self.job_queue.put((job, 0))
+        self.total_jobs += 1
+
     def start_workers(self, worker_class, *args):
         """
         Start workers using the specified worker class.
         """
         for _ in range(self.num_workers):
-            worker = worker_class(self.job_queue, self.progress_counter, *args)
+            worker = worker_class(self.job_queue, self.done_queue, *args)
             self.workers.append(worker)
             worker.start()
 
@@ -92,11 +145,16 @@ class BaseManager:
         # Start workers
         self.start_workers(worker_class, *args)
 
-        # Display progress bar
+        # Display progress bar, blocking on the done queue rather than polling
         with alive_bar(self.total_jobs, title=self.title, bar="filling") as bar:
-            while self.progress_counter.value < self.total_jobs:
-                bar(self.progress_counter.value - bar.current)
-            bar(self.total_jobs - bar.current)
+            for _ in range(self.total_jobs):
+                job, ok = self.done_queue.get()
+                if not ok:
+                    self.failed_jobs.append(job)
+                bar()
 
         # Stop workers
-        self.stop_workers()
\ No newline at end of file
+        self.stop_workers()
+
+        if self.failed_jobs:
+            print(f"{len(self.failed_jobs)} jobs failed after {worker_class.max_attempts} attempts: {self.failed_jobs}")
\ No newline at end of file
@@ -1,4 +1,7 @@
 from datetime import datetime, timedelta, timezone
+from typing import Sequence
+
+import pandas as pd
 
 def get_rounded_hour(t: datetime) -> datetime:
     # Rounds to nearest hour by adding a timedelta hour if minute >= 30
@@ -7,3 +10,13 @@ def get_rounded_hour(t: datetime) -> datetime:
 def get_millisecond_datetime(milliseconds: int) -> datetime:
     """Convert UNIX timestamp in milliseconds to Python datetime."""
     return datetime.fromtimestamp(milliseconds / 1000, timezone.utc)
+
+def get_millisecond_datetimes(milliseconds: Sequence[int]) -> list[datetime]:
+    """Convert a sequence of UNIX timestamps in milliseconds to Python datetimes in one vectorized call."""
+    return list(pd.to_datetime(milliseconds, unit="ms", utc=True).to_pydatetime())
+
+def get_naive_utc(t: datetime) -> datetime:
+    """Convert a datetime to naive UTC, as stored in weather_data.date. Naive datetimes are taken to be UTC already."""
+    if t.tzinfo is None:
+        return t
+    return t.astimezone(timezone.utc).replace(tzinfo=None)
@@ -1,68 +1,320 @@
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pacsv
+import shapely
+from collections import OrderedDict
 from datetime import datetime
+from functools import lru_cache
+from io import BytesIO
 
-from sqlalchemy import select
+from sqlalchemy import Float, DateTime, Integer, LargeBinary, and_, any_, bindparam, cast, func, select, true
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.dialects.postgresql import ARRAY
 from sqlalchemy.orm import Session
 import geoalchemy2.functions as gfunc
+from geoalchemy2 import Geometry
 
-from smhi.models import WeatherData, WeatherStation
+from smhi.models import GRID_CELL_SIZE, NearestStationGrid, WeatherData, WeatherStation
+from smhi.util.time import get_naive_utc, get_rounded_hour
+
+# Size in meters of the cells whose centres points are snapped to for cached nearest-station lookups
+NEAREST_SNAP_METERS = 500
+# Least recently used cache of single-point nearest values, see get_cached_nearest_value
+NEAREST_VALUE_CACHE_SIZE = 100_000
+NEAREST_VALUE_CACHE: OrderedDict = OrderedDict()
+
+# Columns that can be requested from the weather data queries, and their types when read through COPY
+WEATHER_DATA_SELECTABLE = {
+    "date_local": WeatherData.date_local,
+    "value": WeatherData.value,
+    "parameter": WeatherData.parameter,
+    "quality": WeatherData.quality,
+    "station_id": WeatherData.weather_station_id,
+    "station_elevation": WeatherStation.height,
+    "x": WeatherStation.x,
+    "y": WeatherStation.y
+}
+WEATHER_DATA_COLUMN_TYPES = {
+    "date_local": pa.timestamp("us"), "value": pa.float64(), "parameter": pa.string(),
+    "quality": pa.string(), "station_id": pa.int64(), "station_elevation": pa.float64(),
+    "x": pa.float64(), "y": pa.float64()
+}
+# Columns that require joining weather_station
+STATION_COLUMNS = {"station_elevation", "x", "y"}
+
+def build_nearest_values_query(use_grid: bool):
+    """
+    Build the query for the value of the nearest weather station to a batch of points.
+    Expects the parameters parameter, xs, ys, timestamps and search_radius (meters).
+    """
+    unnested = func.unnest(
+        bindparam("xs", type_=ARRAY(Float)),
+        bindparam("ys", type_=ARRAY(Float)),
+        bindparam("points", type_=ARRAY(LargeBinary)),
+        bindparam("timestamps", type_=ARRAY(DateTime))
+    ).table_valued("x", "y", "wkb", "date", with_ordinality="idx").render_derived("unnested")
+    # Points arrive as EWKB built client-side. They are cast once per row in a materialized CTE,
+    # so the planner does not inline the cast into every reference in the lateral query.
+    points = select(
+        unnested.c.idx, unnested.c.x, unnested.c.y, unnested.c.date,
+        cast(unnested.c.wkb, Geometry("POINT", srid=3006)).label("geom")
+    ).cte("points").prefix_with("MATERIALIZED")
+
+    point = points.c.geom
+    nearest = (
+        select(WeatherData.value)
+        .join(WeatherStation, WeatherData.weather_station_id == WeatherStation.id)
+        .where(WeatherData.parameter == bindparam("parameter"))
+        .where(WeatherData.date == points.c.date)
+        # Limit the search to the given radius, ST_DWithin can use the spatial index
+        .where(gfunc.ST_DWithin(WeatherStation.geom, point, bindparam("search_radius")))
+        # Order by the <-> operator so PostGIS can return the nearest station through a KNN index scan
+        .order_by(WeatherStation.geom.distance_centroid(point))
+        .limit(1)
+    )
+    source = points
+    if use_grid:
+        # Candidate stations are looked up by cell, the spatial predicates then only rank those few rows
+        nearest = nearest.where(WeatherData.weather_station_id == any_(NearestStationGrid.station_ids))
+        source = points.join(NearestStationGrid, and_(
+            NearestStationGrid.cell_x == cast(func.floor(points.c.x / GRID_CELL_SIZE), Integer),
+            NearestStationGrid.cell_y == cast(func.floor(points.c.y / GRID_CELL_SIZE), Integer),
+            NearestStationGrid.parameter == bindparam("parameter")
+        ))
+    nearest = nearest.lateral("nearest")
+    return (
+        select(points.c.idx, nearest.c.value)
+        .select_from(source.join(nearest, true()))
+    )
+
+@lru_cache
+def build_weather_data_query(columns: tuple[str, ...], time_range: bool):
+    """
+    Build the query for weather data at a timestamp (parameter, timestamp) or in a time range
+    (parameter, start, end), selecting only the given columns. Cached per column set, so each
+    variant is built once and then executed with parameters.
+    """
+    unknown = set(columns) - WEATHER_DATA_SELECTABLE.keys()
+    if unknown:
+        raise ValueError(f"Unknown weather data columns: {sorted(unknown)}")
+
+    query = (
+        select(*(WEATHER_DATA_SELECTABLE[column] for column in columns))
+        .select_from(WeatherData)
+        .where(WeatherData.parameter == bindparam("parameter"))
+    )
+    # Only join the stations when a station attribute is requested
+    if not STATION_COLUMNS.isdisjoint(columns):
+        query = query.join(WeatherStation, WeatherData.weather_station_id == WeatherStation.id)
+    if time_range:
+        return query.where(WeatherData.date.between(bindparam("start"), bindparam("end")))
+    return query.where(WeatherData.date == bindparam("timestamp"))
+
+# Statements are built once at import and executed with parameters, rather than rebuilt per call
+NEAREST_VALUES_QUERY = build_nearest_values_query(use_grid=False)
+NEAREST_VALUES_GRID_QUERY = build_nearest_values_query(use_grid=True)
+
+def copy_query_to_table(session: Session, query, column_types: dict[str, pa.DataType]) -> pa.Table:
+    """
+    Run a query through COPY ... TO STDOUT and parse the CSV stream with pyarrow.
+    Skips building a Python tuple per row, which dominates on large result sets.
+    Columns are named after column_types, in the order of the query's SELECT.
+    """
+    sql = query.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+    buf = BytesIO()
+    with session.connection().connection.cursor() as cur:
+        cur.copy_expert(f"COPY ({sql}) TO STDOUT WITH (FORMAT CSV)", buf)
+    if buf.tell() == 0:
+        return pa.schema(column_types).empty_table()
+    buf.seek(0)
+
+    return pacsv.read_csv(
+        buf,
+        read_options=pacsv.ReadOptions(column_names=list(column_types)),
+        convert_options=pacsv.ConvertOptions(column_types=column_types)
+    )
+
+def table_to_arrays(table: pa.Table) -> dict[str, np.ndarray]:
+    """
+    Return the columns of a table as contiguous NumPy arrays, for numeric code that has no use for pandas.
+    Floating point columns are cast to float32, which is exact enough for SWEREF99 TM meters and measurements.
+    """
+    arrays = {}
+    for name, column in zip(table.column_names, table.columns):
+        if pa.types.is_floating(column.type):
+            column = column.cast(pa.float32())
+        arrays[name] = column.to_numpy()
+    return arrays
+
+def arrays_to_dataframe(arrays: dict[str, np.ndarray]) -> pd.DataFrame:
+    """Wrap arrays returned with as_arrays=True in a DataFrame, e.g. for inspection."""
+    return pd.DataFrame(arrays)
 
 def get_weather_data_at_time(
         session: Session,
         timestamp: datetime,
-        parameter: str
-    ):
-    query = (
-       select(
-           WeatherData.date_local,
-           WeatherData.value,
-           WeatherData.parameter,
-           WeatherData.quality,
-           WeatherStation.id, 
-           WeatherStation.height,
-           gfunc.ST_X(WeatherStation.geom).label("x"),
-           gfunc.ST_Y(WeatherStation.geom).label("y")
+        parameter: str,
+        columns: tuple[str, ...] = (
+            "date_local", "value", "parameter", "quality",
+            "station_id", "station_elevation", "x", "y"
         )
-        .join(WeatherStation, WeatherData.weather_station_id == WeatherStation.id)
-        .where(WeatherData.parameter == parameter)
-        .where(WeatherData.date == timestamp)
-    )
-    weather_data = session.execute(query).fetchall()
-    weather_df = pd.DataFrame(weather_data, columns=[
-        "date_local", "value", "parameter", "quality",
-        "station_id", "station_elevation", 
-        "x", "y"
-    ])
+    ):
+    query = build_weather_data_query(tuple(columns), time_range=False)
+    # weather_data.date is naive UTC, compare against a naive UTC timestamp rather than let Postgres
+    # convert an aware one with the session TimeZone
+    params = {"parameter": parameter, "timestamp": get_naive_utc(timestamp)}
+    # Read-only Core statements run on the session's connection, skipping ORM autoflush and result processing
+    weather_data = session.connection().execute(query, params).fetchall()
+    weather_df = pd.DataFrame(weather_data, columns=list(columns))
     return weather_df
 
 def get_weather_data_in_time_range(
         session: Session,
-        time_range: list[datetime, datetime], 
-        parameter: str
-    ):
-    query = (
-       select(
-           WeatherData.date_local,
-           WeatherData.value,
-           WeatherData.parameter,
-           WeatherStation.id, 
-           WeatherStation.height,
-           gfunc.ST_X(WeatherStation.geom).label("x"),
-           gfunc.ST_Y(WeatherStation.geom).label("y")
+        time_range: list[datetime, datetime] | tuple[datetime, datetime] | slice, 
+        parameter: str,
+        use_copy: bool = True,
+        as_arrays: bool = False,
+        columns: tuple[str, ...] = (
+            "date_local", "value", "parameter",
+            "station_id", "station_elevation", "x", "y"
         )
-        .join(WeatherStation, WeatherData.weather_station_id == WeatherStation.id)
-        .where(WeatherData.parameter == parameter)
-        .where(WeatherData.date >= time_range[0])
-        .where(WeatherData.date <= time_range[1])
-    )
-    weather_data = session.execute(query).fetchall()
-    weather_df = pd.DataFrame(weather_data, columns=[
-        "date_local", "value", "parameter", 
-        "station_id", "station_elevation", 
-        "x", "y"
-    ])
+    ) -> pd.DataFrame | dict[str, np.ndarray]:
+    if isinstance(time_range, slice):
+        start, end = time_range.start, time_range.stop
+    elif isinstance(time_range, (list, tuple)):
+        start, end = time_range
+    else:
+        raise TypeError(f"time_range must be a list, tuple or slice, not {type(time_range).__name__}")
+    if start is None or end is None:
+        raise ValueError(f"time_range needs both a start and an end, got {start} and {end}")
+    # weather_data.date is naive UTC. Convert up front, so the COPY path (literal binds, where Postgres
+    # would ignore an offset) and the bound-parameter path compare the same values.
+    start, end = get_naive_utc(start), get_naive_utc(end)
+    if start > end:
+        raise ValueError(f"time_range start {start} is after its end {end}")
+
+    query = build_weather_data_query(tuple(columns), time_range=True)
+    query = query.params(parameter=parameter, start=start, end=end)
+    if use_copy:
+        table = copy_query_to_table(session, query, {column: WEATHER_DATA_COLUMN_TYPES[column] for column in columns})
+        return table_to_arrays(table) if as_arrays else table.to_pandas()
+
+    weather_data = session.connection().execute(query).fetchall()
+    weather_df = pd.DataFrame(weather_data, columns=list(columns))
+    if as_arrays:
+        return table_to_arrays(pa.Table.from_pandas(weather_df, preserve_index=False))
     return weather_df
 
+def query_nearest_values(
+        session: Session,
+        parameter: str,
+        timestamps: list[datetime],
+        xs: list[float],
+        ys: list[float],
+        search_radius_km: float,
+        use_grid: bool
+    ) -> np.ndarray:
+    """
+    Query the value of the nearest weather station for every (timestamp, x, y) in a single query.
+    With use_grid, only the stations precomputed in NearestStationGrid for the point's cell are
+    considered, otherwise all stations are searched spatially. Points without a value are NaN.
+    Timestamps are converted to naive UTC, as stored in weather_data.date.
+    """
+    query = NEAREST_VALUES_GRID_QUERY if use_grid else NEAREST_VALUES_QUERY
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    points = shapely.set_srid(shapely.points(xs, ys), 3006)
+    params = {
+        "parameter": parameter,
+        "xs": xs.tolist(),
+        "ys": ys.tolist(),
+        "points": shapely.to_wkb(points, include_srid=True).tolist(),
+        "timestamps": [get_naive_utc(timestamp) for timestamp in timestamps],
+        "search_radius": search_radius_km * 1000
+    }
+
+    values = np.full(len(xs), np.nan)
+    for idx, value in session.connection().execute(query, params):
+        if value is not None:
+            values[idx - 1] = value  # WITH ORDINALITY counts from 1
+    return values
+
+def snap_points(
+        timestamps: list[datetime],
+        xs: list[float],
+        ys: list[float]
+    ) -> tuple[list[datetime], np.ndarray, np.ndarray]:
+    """
+    Convert timestamps to naive UTC and round them to the nearest hour, and move coordinates to
+    the centre of their NEAREST_SNAP_METERS cell. Cells are aligned with the NearestStationGrid
+    cells, so a snapped point stays in the grid cell of the original point.
+    Station data is hourly and stations are kilometers apart, so this does not change which
+    measurement is found except for points right on the border between two stations.
+    """
+    snapped_timestamps = [get_rounded_hour(get_naive_utc(timestamp)) for timestamp in timestamps]
+    snapped_xs = (np.floor(np.asarray(xs, dtype=np.float64) / NEAREST_SNAP_METERS) + 0.5) * NEAREST_SNAP_METERS
+    snapped_ys = (np.floor(np.asarray(ys, dtype=np.float64) / NEAREST_SNAP_METERS) + 0.5) * NEAREST_SNAP_METERS
+    return snapped_timestamps, snapped_xs, snapped_ys
+
+def get_nearest_values_to_points(
+        session: Session,
+        parameter: str,
+        timestamps: list[datetime],
+        xs: list[float],
+        ys: list[float],
+        search_radius_km: float = 150.0
+    ) -> np.ndarray:
+    """
+    Return the value of the nearest weather station for every (timestamp, x, y).
+    Points are first resolved through the precomputed NearestStationGrid. Points whose cell is not
+    in the grid, or whose candidate stations have no data at that time, fall back to a spatial search.
+    Points without a station within the search radius, or without data at that time, are NaN.
+    """
+    timestamps = list(timestamps)
+    xs = np.asarray(xs, dtype=np.float64)
+    ys = np.asarray(ys, dtype=np.float64)
+    values = query_nearest_values(session, parameter, timestamps, xs, ys, search_radius_km, use_grid=True)
+
+    missing = np.flatnonzero(np.isnan(values))
+    if missing.size:
+        values[missing] = query_nearest_values(
+            session, parameter,
+            [timestamps[i] for i in missing], xs[missing], ys[missing],
+            search_radius_km, use_grid=False
+        )
+    return values
+
+def get_cached_nearest_value(
+        session: Session,
+        parameter: str,
+        timestamp: datetime,
+        x: float,
+        y: float,
+        search_radius_km: float
+    ) -> float | None:
+    """
+    Cached single-point lookup, keyed on the session's engine and the already snapped point.
+    Lookups are shared between sessions of the same engine, while a miss runs on the given
+    session, inside its transaction. The cache holds the engine but no session.
+    Call clear_nearest_value_cache() after reseeding the database within the same process.
+    """
+    key = (session.get_bind().engine, parameter, timestamp, x, y, search_radius_km)
+    if key in NEAREST_VALUE_CACHE:
+        NEAREST_VALUE_CACHE.move_to_end(key)
+        return NEAREST_VALUE_CACHE[key]
+
+    value = get_nearest_values_to_points(session, parameter, [timestamp], [x], [y], search_radius_km)[0]
+    value = None if np.isnan(value) else float(value)
+    NEAREST_VALUE_CACHE[key] = value
+    if len(NEAREST_VALUE_CACHE) > NEAREST_VALUE_CACHE_SIZE:
+        NEAREST_VALUE_CACHE.popitem(last=False)  # Evict the least recently used point
+    return value
+
+def clear_nearest_value_cache() -> None:
+    """Empty the nearest-value cache, e.g. after reseeding the database."""
+    NEAREST_VALUE_CACHE.clear()
+
 def get_nearest_value_to_point(
         session: Session, 
         parameter: str, 
@@ -71,29 +323,10 @@ def get_nearest_value_to_point(
         y: int,
         search_radius_km: float = 150.0
     ):
-    weather_data_query = (
-        select(
-            WeatherData.value,
-            gfunc.ST_Distance(
-                WeatherStation.geom,
-                gfunc.ST_SetSRID(gfunc.ST_MakePoint(x, y), 3006)
-            ).label("distance")
-        )
-        .join(WeatherStation, WeatherData.weather_station_id == WeatherStation.id)
-        .where(WeatherData.parameter == parameter)
-        .where(WeatherData.date == timestamp)
-        .order_by("distance")
-    )
-    # Limit the search to the given radius
-    weather_data_query = weather_data_query.where(
-        gfunc.ST_Distance(
-            WeatherStation.geom,
-            gfunc.ST_SetSRID(gfunc.ST_MakePoint(x, y), 3006)
-        ) <= search_radius_km * 1000
-    )
-    # Fetch the nearest weather data record
-    nearest_weather_data = session.execute(weather_data_query).first()
-
-    if nearest_weather_data:
-        return nearest_weather_data[0]
-    return None
\ No newline at end of file
+    """
+    Return the value of the nearest weather station to a point, or None.
+    The point is snapped to the hour and to the centre of its NEAREST_SNAP_METERS cell (see
+    snap_points), so repeated lookups along a dense track are served from an in-process cache.
+    """
+    (timestamp,), (x,), (y,) = snap_points([timestamp], [x], [y])
+    return get_cached_nearest_value(session, parameter, timestamp, float(x), float(y), search_radius_km)